@@ -1,6 +1,33 @@
 from math import cos, pi, sqrt, ceil
-
-from kandinsky import set_pixel
+try: from array import array
+except ImportError: array = None
+
+IDCT_TABLE = [[cos((pi / 8) * (p + 0.5) * n) * (1 / sqrt(2) if n == 0 else 1) for n in range(8)] for p in range(8)]
+ZIGZAG = [
+    0, 1, 5, 6, 14, 15, 27, 28,
+    2, 4, 7, 13, 16, 26, 29, 42,
+    3, 8, 12, 17, 25, 30, 41, 43,
+    9, 11, 18, 24, 31, 40, 44, 53,
+    10, 19, 23, 32, 39, 45, 52, 54,
+    20, 22, 33, 38, 46, 51, 55, 60,
+    21, 34, 37, 47, 50, 56, 59, 61,
+    35, 36, 48, 49, 57, 58, 62, 63,
+]
+NATURAL_ORDER = [
+    0, 1, 8, 16, 9, 2, 3, 10,
+    17, 24, 32, 25, 18, 11, 4, 5,
+    12, 19, 26, 33, 40, 48, 41, 34,
+    27, 20, 13, 6, 7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36,
+    29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46,
+    53, 60, 61, 54, 47, 55, 62, 63,
+]
+COLOR_SHIFT = 16
+CR_TO_R = 91881
+CB_TO_G = -22554
+CR_TO_G = -46802
+CB_TO_B = 116130
 
 def create_huffman_tree(lengths, elements):
     tree = []
@@ -36,16 +63,29 @@ def decode_number(category, bits):
     return bits if bits >= l else bits - (l * 2 - 1)
 
 def YCbCr_to_rgb(Y, Cb, Cr):
-    r = Y + 1.402 * (Cr - 128)
-    g = Y - 0.34414 * (Cb - 128) - 0.714136 * (Cr - 128)
-    b = Y + 1.772 * (Cb - 128)
-    r = max(0, min(255, round(r)))
-    g = max(0, min(255, round(g)))
-    b = max(0, min(255, round(b)))
+    Y = (Y << COLOR_SHIFT) + (1 << (COLOR_SHIFT - 1))
+    Cb -= 128
+    Cr -= 128
+    r = (Y + CR_TO_R * Cr) >> COLOR_SHIFT
+    g = (Y + CB_TO_G * Cb + CR_TO_G * Cr) >> COLOR_SHIFT
+    b = (Y + CB_TO_B * Cb) >> COLOR_SHIFT
+    r = max(0, min(255, r))
+    g = max(0, min(255, g))
+    b = max(0, min(255, b))
     return (r, g, b)
 
+def row_order(order, nb_rows):
+    if order == "interlaced":
+        rows = []
+        for start, step in ((0, 8), (4, 8), (2, 4), (1, 2)):
+            rows += range(start, nb_rows, step)
+        return rows
+    if order == "center":
+        return sorted(range(nb_rows), key=lambda row: abs(2 * row - (nb_rows - 1)))
+    return list(range(nb_rows))
+
 class JpegViewer:
-    def __init__(self, buffer):
+    def __init__(self, buffer, max_kb_coeffs_size=16.0, set_pixel=None, order=None):
         self.buffer = buffer
         self.bit_pos = 0
         self.components = {} 
@@ -53,7 +93,18 @@ class JpegViewer:
         self.quant_tables = {}
         self.sampling = [0, 0]
         self.width = self.height = 0
-        self.idct_table = []
+        self.set_pixel = set_pixel
+        self.order = order
+
+        self.progressive = False
+        self.max_coeffs_size = int(max_kb_coeffs_size * 1024)
+        self.coeffs = []
+        self.band = 64
+        self.mcus = [0, 0]
+        self.scan_components = []
+        self.spectral = [0, 63]
+        self.approx = [0, 0]
+        self.eobrun = 0
 
         self.read_markers()
         
@@ -64,12 +115,16 @@ class JpegViewer:
             elif marker == 0xFFD9:
                 break 
             elif marker == 0xFFC4: self.define_huffman_table()
+            elif marker == 0xFFFE: self.read_comment()
             elif marker == 0xFFDB: self.define_quantization_table()
-            elif marker == 0xFFC0:
+            elif marker == 0xFFC0 or marker == 0xFFC2:
+                self.progressive = marker == 0xFFC2
                 self.parse_frame_header() 
             elif marker == 0xFFDA: 
                 self.parse_scan_header()
-                self.scan()
+                if self.progressive: self.progressive_scan()
+                else: self.scan()
+                self.seek_marker()
             else: self.skip(self.read(2, peak=True)) 
             if self.bit_pos // 8 >= len(self.buffer): break
 
@@ -84,6 +139,12 @@ class JpegViewer:
 
         self.huffman_tables[table_info] = create_huffman_tree(lengths, elements)
 
+    def read_comment(self):
+        length = self.read(2)
+        comment = self.read(length - 2, True)
+        if self.order is None and comment[:6] == b"order:":
+            self.order = list(comment[6:])
+
     def define_quantization_table(self):
         self.skip(2) 
         table_info = self.read(1)
@@ -98,39 +159,231 @@ class JpegViewer:
 
         for _ in range(nb_components):
             component_id = self.read(1)
-            self.sampling[0] = max(self.sampling[0], self.read(1, peak=True) >> 4)
-            self.sampling[1] = max(self.sampling[1], self.read(1) & 0xF)
-            self.components[component_id] = {b"quant_mapping": self.read(1)}
+            h_sampling = self.read(1, peak=True) >> 4
+            v_sampling = self.read(1) & 0xF
+            self.sampling[0] = max(self.sampling[0], h_sampling)
+            self.sampling[1] = max(self.sampling[1], v_sampling)
+            self.components[component_id] = {b"quant_mapping": self.read(1), b"H": h_sampling, b"V": v_sampling}
+
+        if self.progressive: self.allocate_coefficients()
+
+    def allocate_coefficients(self):
+        self.mcus[0] = ceil(self.width / (8 * self.sampling[0]))
+        self.mcus[1] = ceil(self.height / (8 * self.sampling[1]))
+
+        nb_blocks = 0
+        for component in self.components.values():
+            component[b"offset"] = nb_blocks
+            component[b"line"] = self.mcus[0] * component[b"H"]
+            nb_blocks += component[b"line"] * self.mcus[1] * component[b"V"]
+
+        coeff_size = 2 if array else 4
+        self.band = max(1, min(64, self.max_coeffs_size // (coeff_size * nb_blocks)))
+        while True:
+            try:
+                if array: self.coeffs = array("h", bytes(2 * nb_blocks * self.band))
+                else: self.coeffs = [0] * (nb_blocks * self.band)
+                break
+            except MemoryError:
+                if self.band == 1: raise
+                self.band //= 2
 
     def parse_scan_header(self):
         self.skip(2) 
         nb_components = self.read(1)
+        self.scan_components = []
         for _ in range(nb_components):
             component_id = self.read(1)
+            self.scan_components.append(component_id)
             self.components[component_id][b"DC"] = self.read(1, peak=True) >> 4 
             self.components[component_id][b"AC"] = self.read(1) & 0xF 
 
-        self.skip(3) 
+        self.spectral[0] = self.read(1)
+        self.spectral[1] = self.read(1)
+        self.approx[0] = self.read(1, peak=True) >> 4
+        self.approx[1] = self.read(1) & 0xF
 
     def scan(self):
-        self.idct_table = [[cos((pi / 8) * (p + 0.5) * n) * (1 / sqrt(2) if n == 0 else 1) for n in range(8)] for p in range(8)]
+        self.load_screen()
+        nb_rows = ceil(self.height / (8 * self.sampling[1]))
+        rows = self.display_order(nb_rows)
+
+        if rows == list(range(nb_rows)):
+            old_dc_coeffs = [0, 0, 0]
+            for y in rows:
+                self.decode_row(y, old_dc_coeffs)
+            return
+
+        row_starts = self.index_rows(nb_rows)
+        scan_end = self.bit_pos
+        for y in rows:
+            self.bit_pos = row_starts[y][0]
+            self.decode_row(y, list(row_starts[y][1:]))
+        self.bit_pos = scan_end
+
+    def display_order(self, nb_rows):
+        if isinstance(self.order, list):
+            return self.order if sorted(self.order) == list(range(nb_rows)) else list(range(nb_rows))
+        return row_order(self.order or "raster", nb_rows)
+
+    def index_rows(self, nb_rows):
+        old_dc_coeffs = [0, 0, 0]
+        samplings = self.sampling[0] * self.sampling[1]
+        row_starts = []
+        for _ in range(nb_rows):
+            row_starts.append((self.bit_pos, old_dc_coeffs[0], old_dc_coeffs[1], old_dc_coeffs[2]))
+            for _ in range(ceil(self.width / (8 * self.sampling[0]))):
+                for _ in range(samplings):
+                    old_dc_coeffs[0] = self.read_block(self.components[1], old_dc_coeffs[0])[1]
+                old_dc_coeffs[1] = self.read_block(self.components[2], old_dc_coeffs[1])[1]
+                old_dc_coeffs[2] = self.read_block(self.components[3], old_dc_coeffs[2])[1]
+
+        return row_starts
 
-        old_y_coeff = old_cb_coeff = old_cr_coeff = 0
+    def decode_row(self, y, old_dc_coeffs):
         samplings = self.sampling[0] * self.sampling[1]
+        for x in range(ceil(self.width / (8 * self.sampling[0]))):
+            y_mats = []
+            for _ in range(samplings):
+                y_mat, old_dc_coeffs[0] = self.build_matrix(self.components[1], old_dc_coeffs[0])
+                y_mats.append(y_mat)
+
+            cb_mat, old_dc_coeffs[1] = self.build_matrix(self.components[2], old_dc_coeffs[1])
+            cr_mat, old_dc_coeffs[2] = self.build_matrix(self.components[3], old_dc_coeffs[2])
+
+            self.display_pixels(x, y, y_mats, cb_mat, cr_mat)
+
+    def progressive_scan(self):
+        start, end = self.spectral
+        if start and (start >= self.band or (self.approx[0] and end >= self.band)): return
+
+        self.eobrun = 0
+        components = [self.components[component_id] for component_id in self.scan_components]
+        if len(components) == 1:
+            component = components[0]
+            blocks_x = ceil(ceil(self.width * component[b"H"] / self.sampling[0]) / 8)
+            blocks_y = ceil(ceil(self.height * component[b"V"] / self.sampling[1]) / 8)
+            old_dc_coeff = 0
+            for y in range(blocks_y):
+                for x in range(blocks_x):
+                    old_dc_coeff = self.decode_block(component, y * component[b"line"] + x, old_dc_coeff)
+        else:
+            old_dc_coeffs = [0] * len(components)
+            for y in range(self.mcus[1]):
+                for x in range(self.mcus[0]):
+                    for i, component in enumerate(components):
+                        for v in range(component[b"V"]):
+                            for h in range(component[b"H"]):
+                                block = (y * component[b"V"] + v) * component[b"line"] + x * component[b"H"] + h
+                                old_dc_coeffs[i] = self.decode_block(component, block, old_dc_coeffs[i])
+
+        self.display_coefficients()
+
+    def decode_block(self, component, block, old_dc_coeff):
+        index = (component[b"offset"] + block) * self.band
+        if self.spectral[0]:
+            if self.approx[0]: self.refine_ac_coeffs(component, index)
+            else: self.decode_ac_coeffs(component, index)
+            return old_dc_coeff
+
+        if self.approx[0]:
+            if self.get_bit(): self.coeffs[index] |= 1 << self.approx[1]
+            return old_dc_coeff
 
-        for y in range(ceil(self.height / (8 * self.sampling[1]))):
-            for x in range(ceil(self.width / (8 * self.sampling[0]))):
-                y_mats = []
-                for _ in range(samplings):
-                    y_mat, old_y_coeff = self.build_matrix(self.components[1], old_y_coeff)
-                    y_mats.append(y_mat)
+        category = self.read_category(self.huffman_tables[component[b"DC"]])
+        bits = self.read_bits(category)
+        dc_coeff = decode_number(category, bits) + old_dc_coeff if category else old_dc_coeff
+        self.coeffs[index] = dc_coeff << self.approx[1]
+        return dc_coeff
+
+    def decode_ac_coeffs(self, component, index):
+        if self.eobrun:
+            self.eobrun -= 1
+            return
+
+        ac_huffman_table = self.huffman_tables[16 + component[b"AC"]]
+        i = self.spectral[0]
+        while i <= self.spectral[1]:
+            category = self.read_category(ac_huffman_table)
+            run = category >> 4
+            category &= 0x0F
+
+            if category == 0:
+                if run < 15:
+                    self.eobrun = (1 << run) - 1 + self.read_bits(run)
+                    break
+                i += 16
+                continue
+
+            i += run
+            coeff = decode_number(category, self.read_bits(category))
+            if i < self.band: self.coeffs[index + i] = coeff << self.approx[1]
+            i += 1
+
+    def refine_ac_coeffs(self, component, index):
+        coeffs = self.coeffs
+        positive = 1 << self.approx[1]
+        negative = -1 << self.approx[1]
+        i = self.spectral[0]
+        end = self.spectral[1]
+
+        if not self.eobrun:
+            ac_huffman_table = self.huffman_tables[16 + component[b"AC"]]
+            while i <= end:
+                category = self.read_category(ac_huffman_table)
+                run = category >> 4
+                coeff = 0
+                if category & 0x0F:
+                    coeff = positive if self.get_bit() else negative
+                elif run < 15:
+                    self.eobrun = (1 << run) + self.read_bits(run)
+                    break
+
+                while i <= end:
+                    if coeffs[index + i]:
+                        if self.get_bit() and not coeffs[index + i] & positive:
+                            coeffs[index + i] += positive if coeffs[index + i] >= 0 else negative
+                    elif run == 0: break
+                    else: run -= 1
+                    i += 1
+
+                if coeff: coeffs[index + i] = coeff
+                i += 1
+
+        if self.eobrun:
+            while i <= end:
+                if coeffs[index + i] and self.get_bit() and not coeffs[index + i] & positive:
+                    coeffs[index + i] += positive if coeffs[index + i] >= 0 else negative
+                i += 1
+            self.eobrun -= 1
+
+    def display_coefficients(self):
+        self.load_screen()
+        luminance, cb, cr = self.components[1], self.components[2], self.components[3]
+        for y in self.display_order(self.mcus[1]):
+            for x in range(self.mcus[0]):
+                y_mats = [self.coeffs_to_matrix(luminance, (y * luminance[b"V"] + v) * luminance[b"line"] + x * luminance[b"H"] + h)
+                          for v in range(luminance[b"V"]) for h in range(luminance[b"H"])]
+                cb_mat = self.coeffs_to_matrix(cb, y * cb[b"line"] + x)
+                cr_mat = self.coeffs_to_matrix(cr, y * cr[b"line"] + x)
 
-                cb_mat, old_cb_coeff = self.build_matrix(self.components[2], old_cb_coeff)
-                cr_mat, old_cr_coeff = self.build_matrix(self.components[3], old_cr_coeff)
-                
                 self.display_pixels(x, y, y_mats, cb_mat, cr_mat)
 
+    def coeffs_to_matrix(self, component, block):
+        quant_table = self.quant_tables[component[b"quant_mapping"]]
+        index = (component[b"offset"] + block) * self.band
+        result = [0] * 64
+        for i in range(self.band):
+            result[NATURAL_ORDER[i]] = self.coeffs[index + i] * quant_table[i]
+        return self.idct(result)
+
+    def load_screen(self):
+        if self.set_pixel is None:
+            from kandinsky import set_pixel
+            self.set_pixel = set_pixel
+
     def display_pixels(self, x, y, y_mats, cb_mat, cr_mat):
+        set_pixel = self.set_pixel
         block_width = 8 * self.sampling[0]
         block_height = 8 * self.sampling[1]
 
@@ -159,6 +412,12 @@ class JpegViewer:
                     set_pixel(pixel_x, pixel_y, color)
 
     def build_matrix(self, component, old_dc_coeff):
+        result, dc_coeff = self.read_block(component, old_dc_coeff)
+        result = self.rearange_coeffs(result)
+        result = self.idct(result)
+        return result, dc_coeff
+
+    def read_block(self, component, old_dc_coeff):
         quant_table = self.quant_tables[component[b"quant_mapping"]]
 
         category = self.read_category(self.huffman_tables[component[b"DC"]])
@@ -184,43 +443,37 @@ class JpegViewer:
             result[i] = coeff * quant_table[i]
             i += 1
 
-        result = self.rearange_coeffs(result)
-        result = self.idct(result)
         return result, dc_coeff
     
     def idct(self, coeffs):
+        if not any(coeffs[1:]):
+            value = round(coeffs[0] * IDCT_TABLE[0][0] * IDCT_TABLE[0][0] / 4) + 128
+            return [[value] * 8 for _ in range(8)]
+
+        columns = [0] * 64
+        for u in range(8):
+            column = [(v, coeffs[v * 8 + u]) for v in range(8) if coeffs[v * 8 + u]]
+            if not column: continue
+            for y in range(8):
+                idct_y = IDCT_TABLE[y]
+                coeff = 0
+                for v, value in column:
+                    coeff += value * idct_y[v]
+                columns[y * 8 + u] = coeff
+
         output = [[0] * 8 for _ in range(8)]
         for y in range(8):
+            row = [(u, columns[y * 8 + u]) for u in range(8) if columns[y * 8 + u]]
             for x in range(8):
-                idct_y = [self.idct_table[y][n2] for n2 in range(8)]
-                idct_x = [self.idct_table[x][n1] for n1 in range(8)]
-
+                idct_x = IDCT_TABLE[x]
                 coeff = 0
-                for n1 in range(8):
-                    global_n1 = n1 * 8
-                    for n2 in range(8):
-                        coeff += coeffs[global_n1 + n2] * idct_y[n2] * idct_x[n1]
-
-                output[y][x] = round(coeff / 4) + 128
-
+                for u, value in row:
+                    coeff += value * idct_x[u]
+                output[x][y] = round(coeff / 4) + 128
         return output
         
     def rearange_coeffs(self, coeffs):
-        zigzag = [ 
-            0, 1, 5, 6, 14, 15, 27, 28,
-            2, 4, 7, 13, 16, 26, 29, 42,
-            3, 8, 12, 17, 25, 30, 41, 43,
-            9, 11, 18, 24, 31, 40, 44, 53,
-            10, 19, 23, 32, 39, 45, 52, 54,
-            20, 22, 33, 38, 46, 51, 55, 60,
-            21, 34, 37, 47, 50, 56, 59, 61,
-            35, 36, 48, 49, 57, 58, 62, 63,
-        ]
-
-        for i in range(64):
-            zigzag[i] = coeffs[zigzag[i]]
-
-        return zigzag
+        return [coeffs[i] for i in ZIGZAG]
 
     def read_category(self, huffman_tree):
         result = huffman_tree
@@ -239,6 +492,12 @@ class JpegViewer:
     def skip(self, nbytes):
         self.bit_pos += nbytes * 8
 
+    def seek_marker(self):
+        pos = (self.bit_pos + 7) >> 3
+        while pos + 1 < len(self.buffer) and (self.buffer[pos] != 0xFF or self.buffer[pos + 1] in (0x00, 0xFF)):
+            pos += 1
+        self.bit_pos = pos * 8
+
     def get_bit(self):
         self.skip_ff00()
 
@@ -260,4 +519,4 @@ class JpegViewer:
             result = (result << 1) | self.get_bit()
         return result
 
-def open(buffer): JpegViewer(buffer)
+def open(buffer, max_kb_coeffs_size=16.0, set_pixel=None, order=None): JpegViewer(buffer, max_kb_coeffs_size, set_pixel, order)
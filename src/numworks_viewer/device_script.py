@@ -0,0 +1,241 @@
+from __future__ import annotations
+from ast import literal_eval
+from math import log2
+from string import Template
+import argparse
+
+from .viewer import JpegViewer, create_huffman_tree, bytes_to_int, ZIGZAG
+
+# Rough cost of the operations of a generated script on a N0110 calculator (in seconds).
+# It is calibrated on the 5 to 10 minutes that jpeg_viewer.py takes to display a whole image.
+SECONDS_PER_MAC = 50e-6 # One multiply-add of the idct
+SECONDS_PER_PIXEL = 200e-6 # Color conversion and set_pixel call
+SECONDS_PER_BIT = 20e-6 # Reading one bit of the scan data
+SECONDS_PER_BLOCK = 5e-3 # Allocating and dequantizing a block
+
+# Minified decoder of the generated scripts, only the code paths used by baseline images with a known sampling are kept.
+# The sampling is baked into the `$`-prefixed expressions, the image data and the tables are added after it.
+DECODER = Template('''from math import cos,pi,sqrt
+from kandinsky import set_pixel as sp
+z=range;w=round;nc=isinstance
+K=[[cos(pi/8*(p+.5)*n)*(1/sqrt(2)if n==0 else 1)for n in z(8)]for p in z(8)]
+N=$natural_order
+def rc(t):
+ global P
+ while nc(t,list):t=t[B[P>>3]>>7-(P&7)&1];P+=1
+ return t
+def rb(n):
+ global P
+ r=0
+ for _ in z(n):r=r<<1|B[P>>3]>>7-(P&7)&1;P+=1
+ return r
+def dn(c,b):
+ l=1<<c-1
+ return b if b>=l else b-2*l+1
+def ic(c):
+ if not any(c[1:]):v=w(c[0]*K[0][0]*K[0][0]/4)+128;return[v]*64
+ t=[0]*64
+ for u in z(8):
+  g=[(k,c[k*8+u])for k in z(8)if c[k*8+u]]
+  if g:
+   for y in z(8):r=K[y];t[y*8+u]=sum(a*r[k]for k,a in g)
+ o=[0]*64
+ for y in z(8):
+  g=[(u,t[y*8+u])for u in z(8)if t[y*8+u]]
+  for x in z(8):r=K[x];o[y*8+x]=w(sum(a*r[u]for u,a in g)/4)+128
+ return o
+def bk(c,d):
+ q,e,f=c;t=rc(e)
+ if t:d+=dn(t,rb(t))
+ r=[0]*64;r[0]=d*q[0];k=1
+ while k<64:
+  t=rc(f)
+  if t==0:break
+  k+=t>>4;t&=15
+  if k>63:break
+  if t:r[N[k]]=dn(t,rb(t))*q[k]
+  k+=1
+ return ic(r),d
+def open(n=0):
+ global B,P
+ W,H,C,B=I[n];P=0;D=[0,0,0]
+ for my in z((H+$mcu_height-1)//$mcu_height):
+  for mx in z((W+$mcu_width-1)//$mcu_width):
+   Y=[]
+   for _ in z($luma_blocks):m,D[0]=bk(C[0],D[0]);Y.append(m)
+   u,D[1]=bk(C[1],D[1]);v,D[2]=bk(C[2],D[2])
+   x0=mx*$mcu_width;y0=my*$mcu_height
+   for j in z(min($mcu_height,H-y0)):
+    for i in z(min($mcu_width,W-x0)):
+     y=(Y[$luma_block][(j&7)*8+(i&7)]<<16)+32768;k=$chroma_index;b=u[k]-128;r=v[k]-128
+     sp(x0+i,y0+j,(max(0,min(255,y+91881*r>>16)),max(0,min(255,y-22554*b-46802*r>>16)),max(0,min(255,y+116130*b>>16))))
+''')
+
+def parse_jpeg(buffer: bytes) -> dict:
+    """
+    Parses the markers of a baseline jpeg file.
+    Returns its size, sampling, the quantization table and huffman trees of each component and the scan data without byte stuffing.
+    """
+    pos = 2 # Start Of Image
+    quant_tables: dict[int, list[int]] = {}
+    huffman_tables: dict[int, list] = {}
+    components: dict[int, list[int]] = {}
+    while pos < len(buffer):
+        marker = bytes_to_int(buffer[pos : pos + 2])
+        length = bytes_to_int(buffer[pos + 2 : pos + 4])
+        segment = buffer[pos + 4 : pos + 2 + length]
+        pos += 2 + length
+
+        if marker == 0xFFDB: # Define Quantization Table, can contain several tables
+            i = 0
+            while i < len(segment):
+                if segment[i] >> 4: raise ValueError("16 bits quantization tables are not supported")
+                quant_tables[segment[i] & 0xF] = list(segment[i + 1 : i + 65])
+                i += 65
+
+        elif marker == 0xFFC4: # Define Huffman Table, can contain several tables
+            i = 0
+            while i < len(segment):
+                lengths = list(segment[i + 1 : i + 17])
+                elements = list(segment[i + 17 : i + 17 + sum(lengths)])
+                huffman_tables[segment[i]] = create_huffman_tree(lengths, elements)
+                i += 17 + sum(lengths)
+
+        elif marker == 0xFFC0: # Start Of Frame
+            height = bytes_to_int(segment[1:3])
+            width = bytes_to_int(segment[3:5])
+            for i in range(segment[5]):
+                component = segment[6 + i * 3 : 9 + i * 3]
+                components[component[0]] = [component[1] >> 4, component[1] & 0xF, component[2]]
+
+        elif marker == 0xFFDA: # Start Of Scan
+            for i in range(segment[0]):
+                component_id, tables = segment[1 + i * 2 : 3 + i * 2]
+                components[component_id] += [tables >> 4, tables & 0xF]
+
+            end = pos
+            while buffer[end] != 0xFF or buffer[end + 1] in (0x00, 0xFF): end += 1
+            scan_data = buffer[pos:end].replace(b"\xff\x00", b"\xff")
+            break
+
+        elif 0xFFC1 <= marker <= 0xFFCF or marker == 0xFFDD:
+            raise ValueError("Only baseline jpeg images without restart markers are supported")
+
+    if sorted(components) != [1, 2, 3] or components[2][:2] != [1, 1] or components[3][:2] != [1, 1]:
+        raise ValueError("Only YCbCr images with a full resolution luminance are supported")
+
+    return {
+        "size": (width, height),
+        "sampling": tuple(components[1][:2]),
+        # Quantization table, DC huffman tree and AC huffman tree of each component
+        "components": [(quant_tables[components[i][2]], huffman_tables[components[i][3]], huffman_tables[16 + components[i][4]])
+                       for i in (1, 2, 3)],
+        "scan_data": scan_data,
+    }
+
+def divide(variable: str, factor: int) -> str:
+    """Returns the expression dividing a variable by a sampling factor"""
+    if factor == 1: return variable
+    if factor & (factor - 1) == 0: return f"({variable}>>{int(log2(factor))})"
+    return f"({variable}//{factor})"
+
+def generate_device_script(buffers: list[bytes]) -> str:
+    """
+    Generates a standalone numworks script that displays the given baseline jpeg images with `open(index)`.
+    The decoder is specialized for the sampling of the images, and their tables are written as literals.
+    If there is only one image, it is displayed when the script is run.
+    """
+    images = [parse_jpeg(buffer) for buffer in buffers]
+    h_sampling, v_sampling = images[0]["sampling"]
+    if any(image["sampling"] != images[0]["sampling"] for image in images):
+        raise ValueError("Every image of a script must use the same sampling")
+
+    natural_order = [0] * 64 # Natural index of each coefficient in zigzag order
+    for i, zigzag_index in enumerate(ZIGZAG):
+        natural_order[zigzag_index] = i
+
+    script = DECODER.substitute(
+        natural_order=repr(natural_order).replace(" ", ""),
+        mcu_width=8 * h_sampling,
+        mcu_height=8 * v_sampling,
+        luma_blocks=h_sampling * v_sampling,
+        luma_block="0" if h_sampling * v_sampling == 1 else f"(j>>3)*{h_sampling}+(i>>3)",
+        chroma_index=f"{divide('j', v_sampling)}*8+{divide('i', h_sampling)}",
+    )
+
+    # The tables are often shared between components and images so each one is only written once
+    table_names: dict[str, str] = {}
+    for image in images:
+        for component in image["components"]:
+            for table in component:
+                table_literal = repr(table).replace(" ", "")
+                if table_literal not in table_names:
+                    table_names[table_literal] = f"T{len(table_names)}"
+                    script += f"{table_names[table_literal]}={table_literal}\n"
+
+    image_literals = []
+    for image in images:
+        components = ",".join("(" + ",".join(table_names[repr(table).replace(" ", "")] for table in component) + ")"
+                              for component in image["components"])
+        image_literals.append(f"({image['size'][0]},{image['size'][1]},({components}),{image['scan_data']})")
+    script += f"I=[{','.join(image_literals)}]\n"
+
+    if len(images) == 1: script += "open()\n"
+    return script
+
+class DecodeCostCounter(JpegViewer):
+    """JpegViewer that counts the operations done by a generated script instead of computing the pixels"""
+    def __init__(self, buffer: bytes) -> None:
+        self.blocks = self.flat_blocks = self.macs = self.pixels = self.bits = 0
+        super().__init__(buffer, set_pixel=self.count_pixel)
+
+    def count_pixel(self, x: int, y: int, color: tuple[int, int, int]) -> None:
+        """Counts a displayed pixel"""
+        self.pixels += 1
+
+    def scan(self) -> None:
+        """Counts the bits of the scan data"""
+        start = self.bit_pos
+        super().scan()
+        self.bits = self.bit_pos - start
+
+    def idct(self, coeffs: list[int]) -> list[list[int]]:
+        """Counts the multiply-adds of the separable idct used by the generated scripts"""
+        self.blocks += 1
+        if not any(coeffs[1:]): self.flat_blocks += 1
+        else:
+            non_zero_columns = sum(1 for u in range(8) if any(coeffs[v * 8 + u] for v in range(8)))
+            self.macs += 8 * sum(1 for coeff in coeffs if coeff) + 64 * non_zero_columns
+        return [[128] * 8 for _ in range(8)]
+
+def estimate_decode_cost(buffer: bytes) -> dict[str, float]:
+    """Counts the operations needed to display an image with a generated script and estimates the time it takes on a numworks"""
+    counter = DecodeCostCounter(buffer)
+    seconds = (counter.macs * SECONDS_PER_MAC + counter.pixels * SECONDS_PER_PIXEL
+               + counter.bits * SECONDS_PER_BIT + counter.blocks * SECONDS_PER_BLOCK)
+    return {"blocks": counter.blocks, "flat_blocks": counter.flat_blocks, "macs": counter.macs,
+            "pixels": counter.pixels, "bits": counter.bits, "seconds": seconds}
+
+def format_decode_cost(cost: dict[str, float]) -> str:
+    """Returns a readable summary of a decode cost"""
+    return (f"Estimated decode time on the numworks: {cost['seconds'] / 60:.1f}min "
+            f"({cost['blocks']} blocks with {cost['flat_blocks']} flat ones, {cost['macs']} idct multiply-adds, {cost['bits']} bits)")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="A program to pack images encoded by image_encoder into a standalone numworks script")
+    parser.add_argument("output_path", type=str, help="The path to the output python script")
+    parser.add_argument("image_paths", type=str, nargs="+", help="The paths to the python files containing the images")
+    args = parser.parse_args()
+
+    buffers = []
+    for image_path in args.image_paths:
+        with open(image_path) as image_file:
+            buffers.append(literal_eval(image_file.read().partition("=")[2]))
+
+    script = generate_device_script(buffers)
+    with open(args.output_path, "w") as out_file:
+        out_file.write(script)
+
+    print(f"Script saved successfully at [{args.output_path}]\nScript size: {len(script.encode()) / 1024:.2f}KB")
+    for image_path, buffer in zip(args.image_paths, buffers):
+        print(f"{image_path}: {format_decode_cost(estimate_decode_cost(buffer))}")
@@ -1,25 +1,142 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from os import path
+from math import ceil
+from os import path, cpu_count
+from time import perf_counter
 import argparse
+import sys
 
-from PIL import Image
+from PIL import Image, ImageFilter, ImageStat
+
+from .device_script import generate_device_script, estimate_decode_cost, format_decode_cost
+from .viewer import row_order, coefficient_band, NUMWORKS_MAX_KB_COEFFS_SIZE
+
+try: from resource import getrusage, RUSAGE_SELF
+except ImportError: getrusage = None # The resource module is not available on Windows
+
+RESAMPLING_FILTERS = {
+    "nearest": Image.Resampling.NEAREST,
+    "box": Image.Resampling.BOX,
+    "bilinear": Image.Resampling.BILINEAR,
+    "hamming": Image.Resampling.HAMMING,
+    "bicubic": Image.Resampling.BICUBIC,
+    "lanczos": Image.Resampling.LANCZOS,
+}
+
+ROW_ORDERS = ("raster", "interlaced", "center", "saliency")
+MCU_HEIGHT = 16 # Pillow uses a 4:2:0 sampling by default so the MCUs are 16 * 16 pixels
+
+def saliency_order(img: Image.Image) -> list[int]:
+    """Returns the MCU rows sorted from the most detailed one (the one with the most edges) to the least detailed one"""
+    edges = img.convert("L").filter(ImageFilter.FIND_EDGES)
+    nb_rows = ceil(img.height / MCU_HEIGHT)
+    energy = [ImageStat.Stat(edges.crop((0, row * MCU_HEIGHT, img.width, min(img.height, (row + 1) * MCU_HEIGHT)))).mean[0]
+              for row in range(nb_rows)]
+    return sorted(range(nb_rows), key=lambda row: -energy[row])
+
+def reduce_image(img: Image.Image, min_size: tuple[int, int]) -> Image.Image:
+    """
+    Reduces the image by the biggest integer factor that keeps it bigger than `min_size`.
+    Jpeg images are decoded at a reduced scale with `draft`, the other images are reduced with `reduce` after loading.
+    """
+    img.draft("RGB", min_size) # Only does something on jpeg images that are not loaded yet
+
+    factor = min(img.width // min_size[0], img.height // min_size[1])
+    if factor < 2 or img.mode == "I;16": # This mode can't be reduced
+        return img
+    if img.mode not in ("1", "P"): return img.reduce(factor)
+
+    # Palette and bilevel images can't be reduced either, they are converted to a mode that can by strips of rows
+    # that are reduced one by one, so the image is never converted at full size
+    mode = "L" if img.mode == "1" else "RGBA" if "transparency" in img.info else "RGB"
+    reduced = Image.new(mode, (ceil(img.width / factor), ceil(img.height / factor)))
+    strip_height = factor * 64 # A multiple of the factor so the pixels are the same as a reduction of the whole image
+    for y in range(0, img.height, strip_height):
+        strip = img.crop((0, y, img.width, min(img.height, y + strip_height)))
+        reduced.paste(strip.convert(mode).reduce(factor), (0, y // factor))
+    return reduced
+
+def count_blocks(jpeg: Image.Image) -> int:
+    """Returns the number of 8 * 8 blocks of every component of a jpeg image, padding blocks included"""
+    h_max = max(h_sampling for _, h_sampling, _, _ in jpeg.layer)
+    v_max = max(v_sampling for _, _, v_sampling, _ in jpeg.layer)
+    mcus = ceil(jpeg.width / (8 * h_max)) * ceil(jpeg.height / (8 * v_max))
+    return sum(mcus * h_sampling * v_sampling for _, h_sampling, v_sampling, _ in jpeg.layer)
+
+def encode_candidate(img: Image.Image, quality: int, progressive: bool, comment: bytes | None = None) -> BytesIO:
+    """Compresses the image to a jpeg with the given quality and returns the jpeg buffer"""
+    output = BytesIO()
+    # Saving stores the parameters on the image, so each thread needs its own copy
+    img.copy().save(output, format="JPEG", quality=quality, optimize=True, progressive=progressive, comment=comment)
+    return output
+
+def output_content(buffer: bytes, device_script: bool) -> str:
+    """Returns the content of the output file: a standalone script displaying the image or the buffer used by jpeg_viewer.py"""
+    return generate_device_script([buffer]) if device_script else f"b={buffer}"
+
+def reset_peak_memory() -> bool:
+    """
+    Resets the peak memory usage (VmHWM) of the process so it can be measured for a single image.
+    Returns False if the platform doesn't allow it (it's only possible on Linux).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError: return False
+
+def peak_memory_mb() -> float | None:
+    """Returns the peak memory usage (RSS) of the process in MB since the last reset if the platform allows it"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"): return int(line.split()[1]) / 1024 # In KB
+    except OSError: pass
+
+    if getrusage is None: return None
+    peak = getrusage(RUSAGE_SELF).ru_maxrss # Can't be reset, it is the peak of the whole process
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024 # Bytes on macOS, KB on Linux
 
 def encode_image(image_path: str,
                  output_path: str,
                  max_kb_buffer_size: float = 15.0,
                  max_kb_file_size: float = 30.0,
                  strech: bool = False,
-                 open_image: bool = False) -> None:
+                 open_image: bool = False,
+                 progressive: bool = False,
+                 resample: str = "bicubic",
+                 device_script: bool = False,
+                 workers: int | None = None,
+                 order: str = "raster") -> None:
     """
     This function takes an image and either strech it or adds black bars to fit into the numworks viewport.
     It will then compress the image to a jpeg file and adjust the quality to meet the appropriate buffer and file size.
     The resulting bytes are then written as bytes() into the output file.
+    If progressive is set, the jpeg is saved as progressive so the viewer can display a rough image after the first scan.
+    Big images are decoded near the numworks size, and `resample` is the filter used to resize them (see RESAMPLING_FILTERS).
+    If device_script is set, the output file is a standalone numworks script that displays the image (see device_script.py).
+    The qualities are tried by rounds of `workers` candidates (the number of cpus up to 4 by default) that are compressed at the same time,
+    the result is the same as trying them one by one.
+    `order` is the order in which the viewer displays the MCU rows (see ROW_ORDERS), it is stored in a comment of the jpeg.
     """
+    if device_script and progressive:
+        raise ValueError("Device scripts can only be generated for baseline images")
+    if device_script and order != "raster":
+        raise ValueError("Device scripts can only display the images from top to bottom")
+    if workers is not None and workers < 1:
+        raise ValueError("There must be at least one worker")
+
     NUMWORKS_SIZE = 320, 222
+    start_time = perf_counter()
+    image_peak_memory = reset_peak_memory()
+    resample_filter = RESAMPLING_FILTERS[resample]
     with Image.open(image_path) as img:
+        # Keep twice the numworks size so the resampling filter still has enough pixels to work with
+        img = reduce_image(img, (NUMWORKS_SIZE[0] * 2, NUMWORKS_SIZE[1] * 2))
         img = img.crop(img.getbbox()).convert("RGB") # Crop the image to the actual bounding box
 
-        if strech: out_img = img.resize(NUMWORKS_SIZE)
+        if strech: out_img = img.resize(NUMWORKS_SIZE, resample_filter)
         else: # Scale down the image to fit the numworks and add borders to it
             aspect_ratio = img.width / img.height
             if NUMWORKS_SIZE[0] / NUMWORKS_SIZE[1] > aspect_ratio:
@@ -31,7 +148,7 @@ def encode_image(image_path: str,
                 new_width = NUMWORKS_SIZE[0]
                 new_height = int(new_width / aspect_ratio)
             
-            img = img.resize((new_width, new_height))
+            img = img.resize((new_width, new_height), resample_filter)
             
             # Create a blank image with the size of the numworks
             out_img = Image.new("RGB", NUMWORKS_SIZE, (0, 0, 0))
@@ -40,22 +157,50 @@ def encode_image(image_path: str,
             out_img.paste(img, ((NUMWORKS_SIZE[0] - new_width) // 2,
                                 (NUMWORKS_SIZE[1] - new_height) // 2))
         
-        quality = 95
-        while quality > 0:
-            output = BytesIO()
-            out_img.save(output, format="JPEG", quality=quality, optimize=True)
-            
-            buffer_size_kb = output.tell() / 1024 # Convert bytes to kb
-            if buffer_size_kb < max_kb_buffer_size:
-                with open(output_path, "w") as out_file:
-                    out_file.write(f"b={output.getvalue()}")
-                    
-                file_size_kb = path.getsize(output_path) / 1024
-                if file_size_kb < max_kb_file_size: break
+        comment = None
+        if order == "saliency": comment = b"order:" + bytes(saliency_order(out_img))
+        elif order != "raster": comment = b"order:" + bytes(row_order(order, ceil(out_img.height / MCU_HEIGHT)))
+
+        qualities = list(range(95, 0, -5))
+        # More workers than a few would mostly compress qualities that are never checked
+        if workers is None: workers = min(4, cpu_count() or 1)
+        workers = min(workers, len(qualities))
+        found = False
+        with ThreadPoolExecutor(workers) as executor:
+            for i in range(0, len(qualities), workers):
+                round_qualities = qualities[i : i + workers]
+                candidates = executor.map(lambda quality: encode_candidate(out_img, quality, progressive, comment), round_qualities)
 
-            quality -= 5
+                # The candidates are checked from the highest quality, like a sequential search
+                for quality, output in zip(round_qualities, candidates):
+                    buffer_size_kb = output.tell() / 1024 # Convert bytes to kb
+                    if buffer_size_kb >= max_kb_buffer_size: continue
+                    # The output file is only built for the candidates with a small enough buffer
+                    content = output_content(output.getvalue(), device_script)
+                    if len(content.encode()) / 1024 < max_kb_file_size:
+                        found = True
+                        break
+                if found: break
 
+        # If no quality is small enough, the lowest one is kept
+        if not found: content = output_content(output.getvalue(), device_script)
+        with open(output_path, "w") as out_file:
+            out_file.write(content)
+        file_size_kb = path.getsize(output_path) / 1024
+
+        if not found: print("Warning: the image is bigger than the maximum buffer or file size")
         print(f"Image saved successfully at [{output_path}]\nQuality: {quality}, buffer size: {buffer_size_kb:.2f}KB; file size: {file_size_kb:.2f}KB")
+
+        if device_script: print(format_decode_cost(estimate_decode_cost(output.getvalue())))
+        if progressive:
+            band = coefficient_band(count_blocks(Image.open(output)), NUMWORKS_MAX_KB_COEFFS_SIZE)
+            print(f"The numworks script keeps {band}/64 coefficients per block with its {NUMWORKS_MAX_KB_COEFFS_SIZE:g}KB coefficients memory"
+                  + (", the image will be blurrier than a baseline one and the refinement scans that go past them are skipped"
+                     " (the kept coefficients miss their last bits)" if band < 64 else ""))
+
+        peak_memory = peak_memory_mb()
+        memory_label = "peak memory" if image_peak_memory else "process peak memory"
+        print(f"Time: {perf_counter() - start_time:.2f}s" + (f", {memory_label}: {peak_memory:.1f}MB" if peak_memory is not None else ""))
         if open_image: Image.open(output).show()
 
 if __name__ == '__main__':
@@ -66,5 +211,10 @@ if __name__ == '__main__':
     parser.add_argument("-fs", "--max_kb_file_size", type=float, default=30.0, help="The maximum size that the output file should be (in KB)")
     parser.add_argument("-s", "--strech", action="store_true", help="If the image should be streched or not")
     parser.add_argument("-o", "--open_image", action="store_true", help="If the output image should be opened or not")
+    parser.add_argument("-p", "--progressive", action="store_true", help="If the image should be encoded as a progressive jpeg or not")
+    parser.add_argument("-d", "--device_script", action="store_true", help="If the output file should be a standalone numworks script or not")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="The number of jpeg qualities compressed at the same time (the number of cpus up to 4 by default)")
+    parser.add_argument("-or", "--order", type=str, default="raster", choices=ROW_ORDERS, help="The order in which the viewer displays the rows of the image")
+    parser.add_argument("-r", "--resample", type=str, default="bicubic", choices=RESAMPLING_FILTERS, help="The filter used to resize the image")
     args = parser.parse_args()
     encode_image(**vars(args))
@@ -1,6 +1,40 @@
+from __future__ import annotations
 from math import cos, pi, sqrt, ceil
-
-from kandinsky import set_pixel
+from collections.abc import Callable, MutableSequence
+
+# Inverse discrete cosine transform basis, IDCT_TABLE[position][frequency]
+IDCT_TABLE = [[cos((pi / 8) * (p + 0.5) * n) * (1 / sqrt(2) if n == 0 else 1) for n in range(8)] for p in range(8)]
+
+# Index in zigzag order of each coefficient in natural order
+ZIGZAG = [
+    0, 1, 5, 6, 14, 15, 27, 28,
+    2, 4, 7, 13, 16, 26, 29, 42,
+    3, 8, 12, 17, 25, 30, 41, 43,
+    9, 11, 18, 24, 31, 40, 44, 53,
+    10, 19, 23, 32, 39, 45, 52, 54,
+    20, 22, 33, 38, 46, 51, 55, 60,
+    21, 34, 37, 47, 50, 56, 59, 61,
+    35, 36, 48, 49, 57, 58, 62, 63,
+]
+
+# Index in natural order of each coefficient in zigzag order
+NATURAL_ORDER = [
+    0, 1, 8, 16, 9, 2, 3, 10,
+    17, 24, 32, 25, 18, 11, 4, 5,
+    12, 19, 26, 33, 40, 48, 41, 34,
+    27, 20, 13, 6, 7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36,
+    29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46,
+    53, 60, 61, 54, 47, 55, 62, 63,
+]
+
+# YCbCr to rgb factors as fixed point numbers with COLOR_SHIFT fractional bits
+COLOR_SHIFT = 16
+CR_TO_R = 91881 # 1.402
+CB_TO_G = -22554 # -0.34414
+CR_TO_G = -46802 # -0.714136
+CB_TO_B = 116130 # 1.772
 
 def create_huffman_tree(lengths: list[int], elements: list[int]) -> list[int]:
     """
@@ -55,21 +89,53 @@ def decode_number(category: int, bits: int) -> int:
 
 def YCbCr_to_rgb(Y: int, Cb: int, Cr: int) -> tuple[int, int, int]:
     """Converts a YCbCr value to rgb"""
-    r = Y + 1.402 * (Cr - 128)
-    g = Y - 0.34414 * (Cb - 128) - 0.714136 * (Cr - 128)
-    b = Y + 1.772 * (Cb - 128)
+    Y = (Y << COLOR_SHIFT) + (1 << (COLOR_SHIFT - 1)) # Adding 0.5 rounds the values
+    Cb -= 128
+    Cr -= 128
+    r = (Y + CR_TO_R * Cr) >> COLOR_SHIFT
+    g = (Y + CB_TO_G * Cb + CR_TO_G * Cr) >> COLOR_SHIFT
+    b = (Y + CB_TO_B * Cb) >> COLOR_SHIFT
     # Clamping the values
-    r = max(0, min(255, round(r)))
-    g = max(0, min(255, round(g)))
-    b = max(0, min(255, round(b)))
+    r = max(0, min(255, r))
+    g = max(0, min(255, g))
+    b = max(0, min(255, b))
 
     return (r, g, b)
 
+NUMWORKS_MAX_KB_COEFFS_SIZE = 16.0 # Default memory limit of the coefficients in numworks scripts/jpeg_viewer.py
+
+def coefficient_band(nb_blocks: int, max_kb_coeffs_size: float | None) -> int:
+    """Returns how many coefficients of each block a progressive image can keep in the memory limit (all of them if there is none)"""
+    if max_kb_coeffs_size is None: return 64
+    # The coefficients are stored in an array('h'), 2 bytes each
+    return max(1, min(64, int(max_kb_coeffs_size * 1024) // (2 * nb_blocks)))
+
+def row_order(order: str, nb_rows: int) -> list[int]:
+    """
+    Returns the order in which the MCU rows are displayed:
+    "raster" from top to bottom, "interlaced" every 8th row first then the rows in between, "center" from the center to the edges
+    """
+    if order == "interlaced":
+        rows = []
+        for start, step in ((0, 8), (4, 8), (2, 4), (1, 2)):
+            rows += range(start, nb_rows, step)
+        return rows
+    if order == "center":
+        return sorted(range(nb_rows), key=lambda row: abs(2 * row - (nb_rows - 1)))
+    return list(range(nb_rows))
+
 class JpegViewer:
-    def __init__(self, buffer: bytes) -> None:
+    def __init__(self, buffer: bytes, max_kb_coeffs_size: float | None = None,
+                 set_pixel: Callable[[int, int, tuple[int, int, int]], None] | None = None,
+                 order: str | list[int] | None = None) -> None:
         """
         Create a JpegViewer object and decode a jpeg file buffer.
         The buffer size should be around 5KB
+        `max_kb_coeffs_size` is the memory that progressive images can use to store their coefficients,
+        there is no limit by default (the numworks script uses NUMWORKS_MAX_KB_COEFFS_SIZE).
+        `set_pixel` is the function used to draw the pixels, kandinsky's one is used by default.
+        `order` is the order of the MCU rows on the screen (see `row_order`) or a list of rows,
+        by default the order stored in the image by the encoder is used and the image is displayed from top to bottom otherwise.
         """
         self.buffer: bytes = buffer
         self.bit_pos: int = 0
@@ -79,7 +145,19 @@ class JpegViewer:
         self.sampling = [0, 0]
         self.width = 0
         self.height = 0
-        self.idct_table: list[list[int]] = []
+        self.set_pixel = set_pixel
+        self.order = order
+
+        # Progressive jpeg state
+        self.progressive: bool = False
+        self.max_kb_coeffs_size = max_kb_coeffs_size
+        self.coeffs: MutableSequence[int] = [] # Coefficients of every block, kept between the scans
+        self.band: int = 64 # Number of coefficients (in zigzag order) stored per block
+        self.mcus = [0, 0]
+        self.scan_components: list[int] = []
+        self.spectral = [0, 63] # Spectral selection start and end
+        self.approx = [0, 0] # Successive approximation high and low bits
+        self.eobrun: int = 0
 
         self.read_markers()
         
@@ -92,14 +170,18 @@ class JpegViewer:
                 break # End Of Image
 
             elif marker == 0xFFC4: self.define_huffman_table()
+            elif marker == 0xFFFE: self.read_comment()
             elif marker == 0xFFDB: self.define_quantization_table()
 
-            elif marker == 0xFFC0:
+            elif marker == 0xFFC0 or marker == 0xFFC2:
+                self.progressive = marker == 0xFFC2
                 self.parse_frame_header() # Start Of Frame
 
             elif marker == 0xFFDA: # Start Of Scan
                 self.parse_scan_header()
-                self.scan()
+                if self.progressive: self.progressive_scan()
+                else: self.scan()
+                self.seek_marker()
 
             else: self.skip(self.read(2, peak=True)) # Skip the section
 
@@ -121,6 +203,16 @@ class JpegViewer:
 
         self.huffman_tables[table_info] = create_huffman_tree(lengths, elements)
 
+    def read_comment(self) -> None:
+        """
+        Comment (COM) section.
+        The encoder can store the display order of the MCU rows in a comment starting with "order:".
+        """
+        length = self.read(2)
+        comment = self.read(length - 2, True)
+        if self.order is None and comment[:6] == b"order:":
+            self.order = list(comment[6:])
+
     def define_quantization_table(self) -> None:
         """
         Define Quantization Table (DQT) section.
@@ -133,7 +225,7 @@ class JpegViewer:
 
     def parse_frame_header(self) -> None:
         """
-        Start Of Frame header (SOF0) section.
+        Start Of Frame header (SOF0 or SOF2) section.
         Parses different information about the structure of the start of scan section
         """
         self.skip(3) # Table length and data precision
@@ -143,9 +235,37 @@ class JpegViewer:
         
         for _ in range(nb_components):
             component_id = self.read(1)
-            self.sampling[0] = max(self.sampling[0], self.read(1, peak=True) >> 4)
-            self.sampling[1] = max(self.sampling[1], self.read(1) & 0xF)
-            self.components[component_id] = {b"quant_mapping": self.read(1)}
+            h_sampling = self.read(1, peak=True) >> 4
+            v_sampling = self.read(1) & 0xF
+            self.sampling[0] = max(self.sampling[0], h_sampling)
+            self.sampling[1] = max(self.sampling[1], v_sampling)
+            self.components[component_id] = {b"quant_mapping": self.read(1), b"H": h_sampling, b"V": v_sampling}
+
+        if self.progressive: self.allocate_coefficients()
+
+    def allocate_coefficients(self) -> None:
+        """
+        Allocates the list that stores the coefficients of every block between the progressive scans.
+        If it doesn't fit in the memory limit, only the first coefficients (lowest frequencies) of each block are kept.
+        """
+        self.mcus[0] = ceil(self.width / (8 * self.sampling[0]))
+        self.mcus[1] = ceil(self.height / (8 * self.sampling[1]))
+
+        nb_blocks = 0
+        for component in self.components.values():
+            component[b"offset"] = nb_blocks # Index of the first block of the component
+            component[b"line"] = self.mcus[0] * component[b"H"] # Number of blocks in a line
+            nb_blocks += component[b"line"] * self.mcus[1] * component[b"V"]
+
+        from array import array # Only imported for progressive images, it makes the import of the viewer slower
+        self.band = coefficient_band(nb_blocks, self.max_kb_coeffs_size)
+        while True:
+            try:
+                self.coeffs = array("h", bytes(2 * nb_blocks * self.band)) # Zero bytes, 2 per coefficient
+                break
+            except MemoryError:
+                if self.band == 1: raise
+                self.band //= 2
 
     def parse_scan_header(self) -> None:
         """
@@ -154,40 +274,229 @@ class JpegViewer:
         """
         self.skip(2) # Header size
         nb_components = self.read(1)
+        self.scan_components = []
         for _ in range(nb_components):
             component_id = self.read(1)
+            self.scan_components.append(component_id)
             self.components[component_id][b"DC"] = self.read(1, peak=True) >> 4 # Gets the DC table index
             self.components[component_id][b"AC"] = self.read(1) & 0xF # Gets the AC table index
 
-        self.skip(3) # Meaningless data
+        # Spectral selection and successive approximation (only used by progressive images)
+        self.spectral[0] = self.read(1)
+        self.spectral[1] = self.read(1)
+        self.approx[0] = self.read(1, peak=True) >> 4
+        self.approx[1] = self.read(1) & 0xF
 
     def scan(self) -> None:
         """
         Start Of Scan (SOS) section.
         Interpret and displays the actual image data that is inside the jpeg file
         """
-        # Precompute table for the inverse decrete cosine transform
-        self.idct_table = [[cos((pi / 8) * (p + 0.5) * n) * (1 / sqrt(2) if n == 0 else 1) for n in range(8)] for p in range(8)]
+        self.load_screen()
+        nb_rows = ceil(self.height / (8 * self.sampling[1]))
+        rows = self.display_order(nb_rows)
+
+        if rows == list(range(nb_rows)): # The rows are decoded in the order of the file
+            old_dc_coeffs = [0, 0, 0]
+            for y in rows:
+                self.decode_row(y, old_dc_coeffs)
+            return
+
+        # The bit position and DC coefficients at the start of each row are needed to decode them in another order
+        row_starts = self.index_rows(nb_rows)
+        scan_end = self.bit_pos
+        for y in rows:
+            self.bit_pos = row_starts[y][0]
+            self.decode_row(y, list(row_starts[y][1:]))
+        self.bit_pos = scan_end
+
+    def display_order(self, nb_rows: int) -> list[int]:
+        """Returns the order in which the MCU rows are displayed, the raster order is used if the given order doesn't fit the image"""
+        if isinstance(self.order, list):
+            return self.order if sorted(self.order) == list(range(nb_rows)) else list(range(nb_rows))
+        return row_order(self.order or "raster", nb_rows)
+
+    def index_rows(self, nb_rows: int) -> list[tuple[int, int, int, int]]:
+        """
+        Reads the scan data without computing the pixels.
+        Returns the bit position and the DC coefficients of every component at the start of each MCU row.
+        """
+        old_dc_coeffs = [0, 0, 0]
+        samplings = self.sampling[0] * self.sampling[1]
+        row_starts = []
+        for _ in range(nb_rows):
+            row_starts.append((self.bit_pos, old_dc_coeffs[0], old_dc_coeffs[1], old_dc_coeffs[2]))
+            for _ in range(ceil(self.width / (8 * self.sampling[0]))):
+                for _ in range(samplings):
+                    old_dc_coeffs[0] = self.read_block(self.components[1], old_dc_coeffs[0])[1]
+                old_dc_coeffs[1] = self.read_block(self.components[2], old_dc_coeffs[1])[1]
+                old_dc_coeffs[2] = self.read_block(self.components[3], old_dc_coeffs[2])[1]
 
-        old_y_coeff = old_cb_coeff = old_cr_coeff = 0
+        return row_starts
+
+    def decode_row(self, y: int, old_dc_coeffs: list[int]) -> None:
+        """Decodes and displays a row of MCUs, `old_dc_coeffs` are the DC coefficients of the previous blocks and are updated"""
         samplings = self.sampling[0] * self.sampling[1]
+        for x in range(ceil(self.width / (8 * self.sampling[0]))):
+            y_mats = []
+            for _ in range(samplings):
+                y_mat, old_dc_coeffs[0] = self.build_matrix(self.components[1], old_dc_coeffs[0])
+                y_mats.append(y_mat)
 
-        # This loop runs for every MCU of the file
-        for y in range(ceil(self.height / (8 * self.sampling[1]))):
-            for x in range(ceil(self.width / (8 * self.sampling[0]))):
-                y_mats = []
-                for _ in range(samplings):
-                    y_mat, old_y_coeff = self.build_matrix(self.components[1], old_y_coeff)
-                    y_mats.append(y_mat)
+            cb_mat, old_dc_coeffs[1] = self.build_matrix(self.components[2], old_dc_coeffs[1])
+            cr_mat, old_dc_coeffs[2] = self.build_matrix(self.components[3], old_dc_coeffs[2])
+
+            self.display_pixels(x, y, y_mats, cb_mat, cr_mat)
+
+    def progressive_scan(self) -> None:
+        """
+        Start Of Scan (SOS) section of a progressive image.
+        Decodes the coefficients of the scan into the stored blocks and displays the refined image.
+        """
+        start, end = self.spectral
+        # AC scans outside of the stored band are skipped, as well as refinements that need coefficients that aren't stored
+        if start and (start >= self.band or (self.approx[0] and end >= self.band)): return
+
+        self.eobrun = 0
+        components = [self.components[component_id] for component_id in self.scan_components]
+        if len(components) == 1: # Non interleaved scan: the blocks outside of the image are not coded
+            component = components[0]
+            blocks_x = ceil(ceil(self.width * component[b"H"] / self.sampling[0]) / 8)
+            blocks_y = ceil(ceil(self.height * component[b"V"] / self.sampling[1]) / 8)
+            old_dc_coeff = 0
+            for y in range(blocks_y):
+                for x in range(blocks_x):
+                    old_dc_coeff = self.decode_block(component, y * component[b"line"] + x, old_dc_coeff)
+        else:
+            old_dc_coeffs = [0] * len(components)
+            for y in range(self.mcus[1]):
+                for x in range(self.mcus[0]):
+                    for i, component in enumerate(components):
+                        for v in range(component[b"V"]):
+                            for h in range(component[b"H"]):
+                                block = (y * component[b"V"] + v) * component[b"line"] + x * component[b"H"] + h
+                                old_dc_coeffs[i] = self.decode_block(component, block, old_dc_coeffs[i])
+
+        self.display_coefficients()
+
+    def decode_block(self, component: dict[bytes, int], block: int, old_dc_coeff: int) -> int:
+        """Decodes the part of a block that is in the current progressive scan and returns the new DC coefficient"""
+        index = (component[b"offset"] + block) * self.band
+        if self.spectral[0]:
+            if self.approx[0]: self.refine_ac_coeffs(component, index)
+            else: self.decode_ac_coeffs(component, index)
+            return old_dc_coeff
+
+        if self.approx[0]: # DC refinement, one bit per block
+            if self.get_bit(): self.coeffs[index] |= 1 << self.approx[1]
+            return old_dc_coeff
+
+        category = self.read_category(self.huffman_tables[component[b"DC"]])
+        bits = self.read_bits(category)
+        dc_coeff = decode_number(category, bits) + old_dc_coeff if category else old_dc_coeff
+        self.coeffs[index] = dc_coeff << self.approx[1]
+        return dc_coeff
+
+    def decode_ac_coeffs(self, component: dict[bytes, int], index: int) -> None:
+        """Decodes the AC coefficients of a block on the first scan of a spectral band"""
+        if self.eobrun: # This block is inside of an End Of Band run
+            self.eobrun -= 1
+            return
+
+        ac_huffman_table = self.huffman_tables[16 + component[b"AC"]]
+        i = self.spectral[0]
+        while i <= self.spectral[1]:
+            category = self.read_category(ac_huffman_table)
+            run = category >> 4
+            category &= 0x0F
+
+            if category == 0:
+                if run < 15: # End Of Band run
+                    self.eobrun = (1 << run) - 1 + self.read_bits(run)
+                    break
+                i += 16 # Run of 16 zeros
+                continue
+
+            i += run
+            coeff = decode_number(category, self.read_bits(category))
+            if i < self.band: self.coeffs[index + i] = coeff << self.approx[1]
+            i += 1
+
+    def refine_ac_coeffs(self, component: dict[bytes, int], index: int) -> None:
+        """Refines the AC coefficients of a block by one bit (successive approximation)"""
+        coeffs = self.coeffs
+        positive = 1 << self.approx[1]
+        negative = -1 << self.approx[1]
+        i = self.spectral[0]
+        end = self.spectral[1]
+
+        if not self.eobrun:
+            ac_huffman_table = self.huffman_tables[16 + component[b"AC"]]
+            while i <= end:
+                category = self.read_category(ac_huffman_table)
+                run = category >> 4
+                coeff = 0
+                if category & 0x0F: # A new coefficient of magnitude 1
+                    coeff = positive if self.get_bit() else negative
+                elif run < 15: # End Of Band run
+                    self.eobrun = (1 << run) + self.read_bits(run)
+                    break
+
+                # Skips `run` zero coefficients and refines the non zero ones on the way
+                while i <= end:
+                    if coeffs[index + i]:
+                        if self.get_bit() and not coeffs[index + i] & positive:
+                            coeffs[index + i] += positive if coeffs[index + i] >= 0 else negative
+                    elif run == 0: break
+                    else: run -= 1
+                    i += 1
+
+                if coeff: coeffs[index + i] = coeff
+                i += 1
+
+        if self.eobrun: # Only the non zero coefficients are refined in an End Of Band run
+            while i <= end:
+                if coeffs[index + i] and self.get_bit() and not coeffs[index + i] & positive:
+                    coeffs[index + i] += positive if coeffs[index + i] >= 0 else negative
+                i += 1
+            self.eobrun -= 1
+
+    def display_coefficients(self) -> None:
+        """Displays the image from the coefficients stored during the progressive scans"""
+        self.load_screen()
+        luminance, cb, cr = self.components[1], self.components[2], self.components[3]
+        for y in self.display_order(self.mcus[1]):
+            for x in range(self.mcus[0]):
+                y_mats = [self.coeffs_to_matrix(luminance, (y * luminance[b"V"] + v) * luminance[b"line"] + x * luminance[b"H"] + h)
+                          for v in range(luminance[b"V"]) for h in range(luminance[b"H"])]
+                cb_mat = self.coeffs_to_matrix(cb, y * cb[b"line"] + x)
+                cr_mat = self.coeffs_to_matrix(cr, y * cr[b"line"] + x)
 
-                cb_mat, old_cb_coeff = self.build_matrix(self.components[2], old_cb_coeff)
-                cr_mat, old_cr_coeff = self.build_matrix(self.components[3], old_cr_coeff)
-                
                 self.display_pixels(x, y, y_mats, cb_mat, cr_mat)
 
+    def coeffs_to_matrix(self, component: dict[bytes, int], block: int) -> list[list[int]]:
+        """
+        Dequantizes the stored coefficients of a block and performs an idct.
+        Only the coefficients of the band are read and the idct skips the others, so it gets cheaper as the band gets smaller.
+        """
+        quant_table = self.quant_tables[component[b"quant_mapping"]]
+        index = (component[b"offset"] + block) * self.band
+        result = [0] * 64
+        for i in range(self.band):
+            result[NATURAL_ORDER[i]] = self.coeffs[index + i] * quant_table[i]
+
+        return self.idct(result)
+
+    def load_screen(self) -> None:
+        """Imports kandinsky if no other function was given to draw the pixels, so the decoder can be used without it"""
+        if self.set_pixel is None:
+            from kandinsky import set_pixel
+            self.set_pixel = set_pixel
+
     def display_pixels(self, x: int, y: int,
                       y_mats: list[list[int]], cb_mat: list[list[int]], cr_mat: list[list[int]]) -> None:
         """Displays the pixels of the decoded matrices"""
+        set_pixel = self.set_pixel
         block_width = 8 * self.sampling[0]
         block_height = 8 * self.sampling[1]
 
@@ -221,6 +530,13 @@ class JpegViewer:
         Reads data to build entirely the 8 * 8 matrix of a component.
         It decodes the DC and AC coeffs, dequantize them, rearange the values, and perform an idct.
         """
+        result, dc_coeff = self.read_block(component, old_dc_coeff)
+        result = self.rearange_coeffs(result)
+        result = self.idct(result)
+        return result, dc_coeff
+
+    def read_block(self, component: list[int], old_dc_coeff: int) -> tuple[list[int], int]:
+        """Decodes the DC and AC coeffs of a block and returns them dequantized in zigzag order with the DC coefficient"""
         quant_table = self.quant_tables[component[b"quant_mapping"]]
 
         category = self.read_category(self.huffman_tables[component[b"DC"]])
@@ -246,46 +562,45 @@ class JpegViewer:
             result[i] = coeff * quant_table[i]
             i += 1
 
-        result = self.rearange_coeffs(result)
-        result = self.idct(result)
         return result, dc_coeff
     
     def idct(self, coeffs: list[int]) -> list[list[int]]:
-        """Computes the Inverse Discrete Cosine Transform and shifts back the transformed value by 128"""
+        """
+        Computes the Inverse Discrete Cosine Transform and shifts back the transformed value by 128.
+        It is done on the columns then on the rows and skips the zero coefficients,
+        with the same operations as the generated device scripts so they display the same pixels.
+        The matrix is indexed by [x][y].
+        """
+        if not any(coeffs[1:]): # Only the DC coefficient: the block has a single color
+            value = round(coeffs[0] * IDCT_TABLE[0][0] * IDCT_TABLE[0][0] / 4) + 128
+            return [[value] * 8 for _ in range(8)]
+
+        columns = [0] * 64 # 1D idct of each column
+        for u in range(8):
+            column = [(v, coeffs[v * 8 + u]) for v in range(8) if coeffs[v * 8 + u]]
+            if not column: continue
+            for y in range(8):
+                idct_y = IDCT_TABLE[y]
+                coeff: float = 0
+                for v, value in column:
+                    coeff += value * idct_y[v]
+                columns[y * 8 + u] = coeff
+
         output = [[0] * 8 for _ in range(8)]
         for y in range(8):
+            row = [(u, columns[y * 8 + u]) for u in range(8) if columns[y * 8 + u]]
             for x in range(8):
-                # Precomputes the tables for given x and y coordinates
-                idct_y = [self.idct_table[y][n2] for n2 in range(8)]
-                idct_x = [self.idct_table[x][n1] for n1 in range(8)]
-
-                coeff: int = 0
-                for n1 in range(8):
-                    global_n1 = n1 * 8
-                    for n2 in range(8):
-                        coeff += coeffs[global_n1 + n2] * idct_y[n2] * idct_x[n1]
-
-                output[y][x] = round(coeff / 4) + 128
+                idct_x = IDCT_TABLE[x]
+                coeff = 0
+                for u, value in row:
+                    coeff += value * idct_x[u]
+                output[x][y] = round(coeff / 4) + 128
 
         return output
         
     def rearange_coeffs(self, coeffs: list[int]) -> list[int]:
         """Changes the order of the coefficients to be in a zigzag order"""
-        zigzag = [ # Initial indices
-            0, 1, 5, 6, 14, 15, 27, 28,
-            2, 4, 7, 13, 16, 26, 29, 42,
-            3, 8, 12, 17, 25, 30, 41, 43,
-            9, 11, 18, 24, 31, 40, 44, 53,
-            10, 19, 23, 32, 39, 45, 52, 54,
-            20, 22, 33, 38, 46, 51, 55, 60,
-            21, 34, 37, 47, 50, 56, 59, 61,
-            35, 36, 48, 49, 57, 58, 62, 63,
-        ]
-
-        for i in range(64):
-            zigzag[i] = coeffs[zigzag[i]]
-
-        return zigzag
+        return [coeffs[i] for i in ZIGZAG]
 
     def read_category(self, huffman_tree: list) -> int:
         """Returns the next category of the buffer using the passed Huffman tree"""
@@ -307,6 +622,13 @@ class JpegViewer:
         """Moves the buffer pointer by n bytes"""
         self.bit_pos += nbytes * 8
 
+    def seek_marker(self) -> None:
+        """Moves the buffer pointer to the next marker, after the end of the scan data"""
+        pos = (self.bit_pos + 7) >> 3
+        while pos + 1 < len(self.buffer) and (self.buffer[pos] != 0xFF or self.buffer[pos + 1] in (0x00, 0xFF)):
+            pos += 1
+        self.bit_pos = pos * 8
+
     def get_bit(self) -> int:
         """Returns the value of the next bit of the buffer"""
         self.skip_ff00()
@@ -331,9 +653,11 @@ class JpegViewer:
             result = (result << 1) | self.get_bit()
         return result
 
-def open(buffer: bytes) -> None:
+def open(buffer: bytes, max_kb_coeffs_size: float | None = None,
+         set_pixel: Callable[[int, int, tuple[int, int, int]], None] | None = None,
+         order: str | list[int] | None = None) -> None:
     """Simple function that makes a new instance of the JpegViewer class using the passed buffer"""
-    JpegViewer(buffer)
+    JpegViewer(buffer, max_kb_coeffs_size, set_pixel, order)
 
 if __name__ == '__main__':
     import sys